@@ -1,132 +1,183 @@
 
 import importlib
+import importlib.util
+import os
 import sys
 import subprocess
+from collections import OrderedDict
+
+# detect_encoding results keyed by (path, mtime_ns, size, sample_size);
+# oldest entries are evicted first once the cache holds _ENC_CACHE_MAX items.
+_ENC_CACHE = OrderedDict()
+_ENC_CACHE_MAX = 128
 
 class Common:
+    # module names already confirmed importable in this process; installs are
+    # additive, so entries never need invalidating
+    _installed = set()
+
     @staticmethod
     def ensure_packages(packages, append_output_func=None):
         """Ensure the given package names are importable; if not, install via pip.
 
         `packages` should be an iterable of importable module names (or pip names).
-        If the list is empty, this is a no-op and returns True.
+        If the list is empty, this is a silent no-op and returns True.
 
         If `append_output_func` is provided it will be called with status messages
         (a single string argument). The function returns True on success, False on failure.
         """
         if not packages:
-            msg = "No packages requested; nothing to do.\n"
-            if append_output_func:
-                try:
-                    append_output_func(msg)
-                except Exception:
-                    pass
-            else:
-                print(msg, file=sys.stderr)
             return True
 
+        # find_spec only asks the import finders whether the module exists;
+        # unlike import_module it does not execute the module's top-level code.
+        # Dotted names import their parent package and may raise.
         missing = []
         for pkg in packages:
+            if pkg in Common._installed:
+                continue
             try:
-                importlib.import_module(pkg)
+                found = importlib.util.find_spec(pkg) is not None
             except Exception:
+                found = False
+            if found:
+                Common._installed.add(pkg)
+            else:
                 missing.append(pkg)
 
         if not missing:
             return True
 
-        total = len(missing)
-        for idx, pkg in enumerate(missing, start=1):
-            start_msg = f"Installing {pkg} ({idx}/{total})\n"
+        def emit(msg):
             if append_output_func:
                 try:
-                    append_output_func(start_msg)
+                    append_output_func(msg)
                 except Exception:
                     pass
             else:
-                print(start_msg, file=sys.stderr)
-
-            cmd = [sys.executable, "-m", "pip", "install", pkg]
-            try:
-                # capture output so GUI can display it
-                proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-                out = proc.stdout or ""
-                if append_output_func and out:
-                    try:
-                        append_output_func(out)
-                    except Exception:
-                        pass
+                print(msg, file=sys.stderr)
 
-                if proc.returncode != 0:
-                    err = f"Failed to install {pkg} ({idx}/{total}): exit {proc.returncode}\n"
-                    if append_output_func:
-                        try:
-                            append_output_func(err)
-                        except Exception:
-                            pass
-                    else:
-                        print(err, file=sys.stderr)
-                    return False
+        # install everything in one pip run: interpreter + pip startup is the
+        # dominant cost, so pay it once instead of once per package
+        total = len(missing)
+        emit(f"Installing {', '.join(missing)} (0/{total})\n")
 
-                # verify import after install
+        try:
+            code = Common._pip_install(missing, append_output_func)
+        except Exception as e:
+            emit(f"Failed to install {', '.join(missing)}: {e}\n")
+            return False
+
+        if code != 0 and total > 1:
+            # pip aborts the whole batch on one bad package; retry one at a
+            # time so the failure names the package responsible
+            for idx, pkg in enumerate(missing, start=1):
+                emit(f"Installing {pkg} ({idx}/{total})\n")
                 try:
-                    importlib.import_module(pkg)
-                except Exception:
-                    warn = f"Package {pkg} installed but import failed ({idx}/{total}).\n"
-                    if append_output_func:
-                        try:
-                            append_output_func(warn)
-                        except Exception:
-                            pass
-                    else:
-                        print(warn, file=sys.stderr)
+                    code = Common._pip_install([pkg], append_output_func)
+                except Exception as e:
+                    emit(f"Failed to install {pkg} ({idx}/{total}): {e}\n")
+                    return False
+                if code != 0:
+                    emit(f"Failed to install {pkg} ({idx}/{total}): exit {code}\n")
                     return False
+        elif code != 0:
+            emit(f"Failed to install {missing[0]}: exit {code}\n")
+            return False
 
-                ok = f"Installed {pkg} ({idx}/{total}).\n"
-                if append_output_func:
-                    try:
-                        append_output_func(ok)
-                    except Exception:
-                        pass
-                else:
-                    print(ok, file=sys.stderr)
+        # verify imports after install
+        importlib.invalidate_caches()
+        for idx, pkg in enumerate(missing, start=1):
+            try:
+                importlib.import_module(pkg)
+            except Exception:
+                emit(f"Package {pkg} installed but import failed ({idx}/{total}).\n")
+                return False
+            Common._installed.add(pkg)
+            emit(f"Installed {pkg} ({idx}/{total}).\n")
 
-            except Exception as e:
-                err = f"Failed to install {pkg} ({idx}/{total}): {e}\n"
-                if append_output_func:
+        return True
+
+    @staticmethod
+    def _pip_install(pkgs, append_output_func=None):
+        """Run one `pip install` for all of `pkgs` and return pip's exit code.
+
+        pip's output is forwarded line by line to `append_output_func`.
+        """
+        cmd = [sys.executable, "-m", "pip", "--disable-pip-version-check",
+               "install", "--progress-bar", "off", *pkgs]
+        # pip only needs stdin/stdout/stderr, so there are no inherited fds
+        # worth closing; close_fds=False lets CPython use posix_spawn()
+        # instead of fork()+exec() on POSIX.
+        # Without a callback the output is never shown, so send it to
+        # DEVNULL rather than reading it back. Otherwise read through a
+        # fully buffered pipe (bufsize=-1, never 0) so each read() pulls a
+        # whole block and lines are split in memory.
+        out_target = subprocess.PIPE if append_output_func else subprocess.DEVNULL
+        proc = subprocess.Popen(cmd, stdout=out_target, stderr=subprocess.STDOUT, text=True,
+                                bufsize=-1, close_fds=(sys.platform == "win32"))
+        if proc.stdout is not None:
+            with proc.stdout:
+                for line in proc.stdout:
                     try:
-                        append_output_func(err)
+                        append_output_func(line)
                     except Exception:
                         pass
-                else:
-                    print(err, file=sys.stderr)
-                return False
-
-        return True
+        return proc.wait()
 
     @staticmethod
     def detect_encoding(path, sample_size=65536):
         """Detect a file's text encoding.
 
-        Tries `charset-normalizer` first (if installed), then falls back to
-        `chardet` if available. If neither is present, checks for common BOMs
-        and otherwise returns 'utf-8' as a sensible default.
+        Checks for common BOMs first and returns 'utf-8' for pure-ASCII samples.
+        Only samples with high-bit bytes go to `charset-normalizer` (if
+        installed), then `chardet` if available; otherwise returns 'utf-8' as
+        a sensible default.
 
-        Returns the detected encoding name as a string (never None).
+        Returns the detected encoding name as a string (never None). Results
+        are cached per path until the file's mtime or size changes.
         """
+        try:
+            st = os.stat(path)
+        except Exception:
+            return 'utf-8'
+        key = (path, st.st_mtime_ns, st.st_size, sample_size)
+        enc = _ENC_CACHE.get(key)
+        if enc is None:
+            enc = Common._detect_encoding(path, sample_size)
+            _ENC_CACHE[key] = enc
+            if len(_ENC_CACHE) > _ENC_CACHE_MAX:
+                _ENC_CACHE.popitem(last=False)
+        return enc
+
+    @staticmethod
+    def _detect_encoding(path, sample_size):
         # Read a sample of the file in binary mode
         try:
             with open(path, 'rb') as f:
                 sample = f.read(sample_size)
         except Exception:
             return 'utf-8'
+        return Common.detect_sample_encoding(sample)
+
+    @staticmethod
+    def detect_sample_encoding(sample):
+        """Detect the text encoding of an in-memory byte sample.
 
+        Runs the same checks as `detect_encoding`, for callers that have
+        already read a sample and would otherwise read the file twice. The
+        result is not cached. Returns the encoding name (never None).
+        """
         # BOM checks (deterministic)
-        if sample.startswith(b'\xef\xbb\bf'):
+        if sample.startswith(b'\xef\xbb\xbf'):
             return 'utf-8-sig'
-        if sample.startswith(b'\xff\xfe') or sample.startswith(b'\xfe\xff'):
+        if sample.startswith((b'\xff\xfe', b'\xfe\xff')):
             return 'utf-16'
 
+        # Pure ASCII decodes identically as utf-8; skip the statistical detectors
+        if sample.isascii():
+            return 'utf-8'
+
         # Try charset-normalizer if available
         try:
             from charset_normalizer import from_bytes
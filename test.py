@@ -1,38 +1,53 @@
 #!/usr/bin/env python3
 import argparse
+import codecs
 import csv
 import datetime
+import mmap
 import sys
-import subprocess
-import importlib
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 from common import Common
 
-# Try to open the file with multiple encodings, returning the first that works
-def open_with_fallback(path):
-    encs_strict = ("utf-8", "utf-8-sig", "gbk", "cp1252", "iso-8859-1")
+# External (non-stdlib) packages this script needs. It currently uses only
+# standard library modules, so --install-missing has nothing to do.
+EXTERNAL_PKGS = ()
+
+# Try to decode a sample with multiple encodings, opening the file with the first that works
+def open_with_fallback(path, sample_size=65536):
+    # text-mode open never fails on bad bytes with errors="replace", so test
+    # the candidates strictly against one binary sample instead
+    with open(path, "rb") as fb:
+        sample = fb.read(sample_size)
+    # the detector reuses the sample and maps a UTF-8 BOM to utf-8-sig; plain
+    # utf-8 would also accept a BOM and leave U+FEFF on the first header
+    encs_strict = tuple(dict.fromkeys((Common.detect_sample_encoding(sample),
+                                       "utf-8-sig", "gbk", "cp1252", "iso-8859-1")))
+    chosen = encs_strict[-1]
     for enc in encs_strict:
         try:
-            # open with newline='' to preserve original CR/LF characters
-            # newline='' 禁用 Python 的通用换行符转换——读/写时不会把 \r\n、\r、\n 统一替换成 \n，也不会自动把 \n 转回平台默认行结束符。读到的内容保持原始字节解码后包含的真实 \r/\n 字符序列。
-            # \r 回车；\n 换行；\t 制表符; \r\n 回车换行,Windows 行结束符
-            f = open(path, "r", encoding=enc, errors="replace", newline='')
-            return f, enc, False
-        except Exception:
+            # incremental decoder: a multi-byte char cut off by the sample end is not an error
+            codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+        except (UnicodeDecodeError, LookupError):
             continue
-
-
-# Compute maximum lengths of trimmed values per column
-def compute_max_lengths(rows, ncols):
-    max_lens = [0] * ncols
-    for r in rows:
-        for i in range(ncols):
-            val = r[i] if i < len(r) else ""
-            trimmed = val.strip()
-            l = len(trimmed)
-            if l > max_lens[i]:
-                max_lens[i] = l
-    return max_lens
+        chosen = enc
+        break
+    # open with newline='' to preserve original CR/LF characters
+    # newline='' 禁用 Python 的通用换行符转换——读/写时不会把 \r\n、\r、\n 统一替换成 \n，也不会自动把 \n 转回平台默认行结束符。读到的内容保持原始字节解码后包含的真实 \r/\n 字符序列。
+    # \r 回车；\n 换行；\t 制表符; \r\n 回车换行,Windows 行结束符
+    f = open(path, "r", encoding=chosen, errors="replace", newline='')
+    return f, chosen, False
+
+
+# csv.reader can only produce an embedded newline inside a quoted field, so a
+# file without a single '"' byte can skip the per-row newline checks.
+def has_quote_bytes(path):
+    try:
+        with open(path, 'rb') as fb, mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # memchr-based search over the mapped pages; nothing is copied
+            return mm.find(b'"') != -1
+    except (OSError, ValueError):
+        # empty files can't be mapped; fall back to the full row checks
+        return True
 
 def write_error_report(errors, output_path=None):
     now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -53,6 +68,34 @@ def write_error_report(errors, output_path=None):
         for e in errors:
             print(e, file=sys.stderr)
 
+def write_lines(out, headers, max_lens):
+    """Write one computed line per column to `out` and return the line count.
+
+    Lines are separated by newlines with no trailing newline; progress goes
+    to stderr so it never mixes with the data stream.
+    """
+    ncols = len(max_lens)
+    for i in range(ncols):
+        header = headers[i].strip() if i < len(headers) else f"COL{i+1}"
+        # escape quotes in header for safety
+        header_safe = header.replace('"', '\\"').replace(" ","_")
+        idx = i + 1
+        idx_padded = f"{idx:03d}"
+        maxlen = max_lens[i]
+        # Build the exact requested string with replacements
+        line = f"F{idx_padded}_{header_safe} computed \nsubstr( alltrim( split( Full_Record , chr( 009 ), {idx_padded} , chr( 34 ) ) ) , 1 , {maxlen} )"
+        # Emit progress so external UIs can display processing progress.
+        # It goes out before the line, and stdout is flushed only at line
+        # ends, so a reader merging both streams never sees a PROGRESS
+        # marker glued to a partial data line.
+        print(f"PROGRESS {idx}/{ncols}", file=sys.stderr, flush=True)
+        out.write(line)
+        if idx < ncols:
+            out.write("\n")
+        if out is sys.stdout:
+            out.flush()
+    return ncols
+
 def main():
     p = argparse.ArgumentParser(description="Generate F001_... computed lines from TSV")
     p.add_argument("file", help="Input TSV file (path required)")
@@ -60,24 +103,31 @@ def main():
     p.add_argument("--install-missing", action="store_true", help="Attempt to install missing Python packages before running")
     args = p.parse_args()
 
-    if getattr(args, 'install_missing', False):
-        # Determine external packages to check here if you have any; currently
-        # this script uses only standard library modules, so pass an empty list.
-        Common.ensure_packages([])
+    # pip runs in a subprocess, so installing in a worker thread overlaps
+    # with the first pass below instead of delaying it
+    install_fut = None
+    if args.install_missing and EXTERNAL_PKGS:
+        pool = ThreadPoolExecutor(max_workers=1)
+        install_fut = pool.submit(Common.ensure_packages, EXTERNAL_PKGS)
+        pool.shutdown(wait=False)
 
     # Two-pass streaming approach (memory-friendly):
-    # 1) First pass: use csv.reader to compute per-column max lengths and
-    #    detect problematic fields (e.g. embedded newlines) while scanning.
-    # 2) Second pass: reopen file and generate the output using computed widths.
+    # 1) First pass: use csv.reader to read the headers, compute per-column
+    #    max lengths and detect problematic fields (e.g. embedded newlines).
+    # 2) Second pass: generate the output using the computed widths.
 
     # detect encoding for the input file and use it for all file opens
     enc = Common.detect_encoding(args.file)
 
     try:
         # First pass: scan file to compute max lengths
-        replaced = False
         errors = []
-        with open(args.file, 'r', encoding=enc, errors='replace', newline='') as fh:
+        check_quoted = has_quote_bytes(args.file)
+        # TextIOWrapper pulls _CHUNK_SIZE (8 KiB) at a time with read1(), which
+        # bypasses an empty buffer, so the 1 MiB buffer only takes effect
+        # when the wrapper asks for chunks of the same size
+        with open(args.file, 'r', encoding=enc, errors='replace', newline='', buffering=1 << 20) as fh:
+            fh._CHUNK_SIZE = 1 << 20
             reader = csv.reader(fh, delimiter='\t')
             try:
                 headers = next(reader)
@@ -90,26 +140,28 @@ def main():
             rowno = 1
             for row in reader:
                 rowno += 1
-                # mark if any replacement occurred during decoding
-                for v in row:
-                    if '\uFFFD' in v:
-                        replaced = True
-                # detect embedded newlines inside fields (treated as data)
-                for colno, v in enumerate(row, start=1):
-                    if '\n' in v or '\r' in v:
-                        errors.append(f"Line {rowno}, Column {colno}: embedded newline in field")
+                if not row:
+                    continue
+                if check_quoted:
+                    # scan the whole row once; clean rows (the common case) never
+                    # reach the per-column checks
+                    joined = '\t'.join(row)
+                    # detect embedded newlines inside fields (treated as data)
+                    if '\n' in joined or '\r' in joined:
+                        for colno, v in enumerate(row, start=1):
+                            if '\n' in v or '\r' in v:
+                                errors.append(f"Line {rowno}, Column {colno}: embedded newline in field")
 
                 if len(row) > ncols:
                     extra = len(row) - ncols
                     max_lens.extend([0] * extra)
                     ncols = len(row)
 
-                for i in range(ncols):
-                    val = row[i] if i < len(row) else ""
-                    trimmed = val.strip()
-                    l = len(trimmed)
-                    if l > max_lens[i]:
-                        max_lens[i] = l
+                # missing trailing cells are empty and can't raise a maximum
+                for i, v in enumerate(row):
+                    n = len(v.strip())
+                    if n > max_lens[i]:
+                        max_lens[i] = n
 
         if errors:
             write_error_report(errors)
@@ -122,46 +174,25 @@ def main():
         print(f"Failed to read '{args.file}': {e}", file=sys.stderr)
         sys.exit(2)
 
-    # headers and max_lens already computed in first pass; ensure header list available
-    # Re-open file briefly to re-read header (if needed for exact original header values)
-    try:
-        with open(args.file, 'r', encoding=enc, errors='replace', newline='') as fh:
-            reader = csv.reader(fh, delimiter='\t')
-            headers = next(reader)
-    except Exception:
-        # header should have been read in first pass; fallback to empty headers
-        headers = [f"COL{i+1}" for i in range(len(max_lens))]
-
-    results = []
-    for i in range(len(max_lens)):
-        header = headers[i].strip() if i < len(headers) else f"COL{i+1}"
-        # escape quotes in header for safety
-        header_safe = header.replace('"', '\\"').replace(" ","_")
-        idx = i + 1
-        idx_padded = f"{idx:03d}"
-        maxlen = max_lens[i] if i < len(max_lens) else 0
-        # Build the exact requested string with replacements
-        line = f"F{idx_padded}_{header_safe} computed \nsubstr( alltrim( split( Full_Record , chr( 009 ), {idx_padded} , chr( 34 ) ) ) , 1 , {maxlen} )"
-        # Emit progress so external UIs can display processing progress
-        try:
-            print(f"PROGRESS {idx}/{ncols}", flush=True)
-        except Exception:
-            pass
-        results.append(line)
-        #sleep(1)  # Simulate a delay for demonstration purposes
-
-    out_text = "\n".join(results)
+    # anything that needs EXTERNAL_PKGS must come after the install finishes
+    if install_fut is not None and not install_fut.result():
+        print(f"Failed to install required packages: {', '.join(EXTERNAL_PKGS)}", file=sys.stderr)
+        sys.exit(4)
 
+    # headers and max_lens were captured in the first pass; columns beyond the
+    # header row fall back to COLn names. Lines are streamed straight to the
+    # destination instead of being collected and joined.
     if args.output:
         try:
-            with open(args.output, "w", encoding="utf-8") as fo:
-                fo.write(out_text)
-            print(f"Wrote {len(results)} lines to '{args.output}'")
+            with open(args.output, "w", encoding="utf-8", buffering=1 << 16) as fo:
+                count = write_lines(fo, headers, max_lens)
+            print(f"Wrote {count} lines to '{args.output}'")
         except Exception as e:
             print(f"Failed to write output: {e}", file=sys.stderr)
             sys.exit(3)
     else:
-        print(out_text)
+        write_lines(sys.stdout, headers, max_lens)
+        sys.stdout.write("\n")
 
 
 if __name__ == '__main__':
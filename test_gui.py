@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 import tkinter as tk
-from tkinter import filedialog, scrolledtext, messagebox
+# filedialog and messagebox are imported where used; they aren't needed
+# until a dialog actually opens
+from tkinter import scrolledtext
 from tkinter import ttk
 import threading
+import queue
 import subprocess
 import sys
 import os
@@ -11,42 +14,79 @@ import re
 
 from common import Common
 
+# matched against the child's raw output bytes
+_PROGRESS_RE_B = re.compile(rb"PROGRESS\s+(\d+)/(\d+)")
+_INSTALL_RE = re.compile(r"\((\d+)/(\d+)\)")
+# leading dotted-name run of an import target; stops at ',', ';', '#', ...
+_MODNAME_RE = re.compile(r"[a-zA-Z0-9_.]+")
+
+# detect_imports results keyed by (path, mtime_ns, size)
+_IMPORTS_CACHE = {}
+
 def detect_imports(script_path):
     """Return a list of top-level imported module names from the given script.
 
     This is a best-effort parser: it looks for lines like `import X` and
-    `from X import ...` and returns the base module `X`.
+    `from X import ...` and returns the base module `X`. Results are cached
+    until the script's mtime or size changes.
     """
+    try:
+        st = os.stat(script_path)
+    except Exception:
+        return []
+    key = (script_path, st.st_mtime_ns, st.st_size)
+    cached = _IMPORTS_CACHE.get(key)
+    if cached is not None:
+        return list(cached)
+
     mods = []
     try:
         enc = Common.detect_encoding(script_path)
+        # one read and one C-level split instead of a readline per line
         with open(script_path, 'r', encoding=enc, errors='replace') as f:
-            for line in f:
-                line = line.strip()
-                m = re.match(r'import\s+([a-zA-Z0-9_\.]+)', line)
-                if m:
-                    base = m.group(1).split('.')[0]
-                    mods.append(base)
-                    continue
-                m = re.match(r'from\s+([a-zA-Z0-9_\.]+)\s+import', line)
-                if m:
-                    base = m.group(1).split('.')[0]
-                    mods.append(base)
+            data = f.read()
+        for line in data.splitlines():
+            # most lines aren't imports; a prefix test rejects them cheaply
+            s = line.lstrip()
+            if not s.startswith(('import', 'from')):
+                continue
+            parts = s.split(None, 2)
+            if len(parts) < 2 or parts[0] not in ('import', 'from'):
+                continue
+            if parts[0] == 'from' and (len(parts) < 3 or not parts[2].startswith('import')):
+                continue
+            # `import a, b` / `import a; import b` -> a; `from a.b import c` -> a
+            m = _MODNAME_RE.match(parts[1])
+            base = m.group(0).split('.', 1)[0] if m else ''
+            # relative imports (`from . import x`) have no base module
+            if base:
+                mods.append(base)
     except Exception:
         return []
     # unique while preserving order
-    seen = set()
-    out = []
-    for m in mods:
-        if m not in seen:
-            seen.add(m)
-            out.append(m)
+    out = list(dict.fromkeys(mods))
+    _IMPORTS_CACHE[key] = tuple(out)
     return out
 
 
 
 SCRIPT_PATH = os.path.join(os.path.dirname(__file__), 'test.py')
 
+# the output log keeps only this many most recent lines
+_MAX_LOG_LINES = 5000
+# how often (ms) and how many queued items per tick _drain_queue applies
+_DRAIN_MS = 30
+_DRAIN_MAX_ITEMS = 1000
+
+# standard library (and local) modules that detect_imports may report but that
+# should never be handed to pip
+_BLACKLIST = frozenset({
+    'sys', 'os', 're', 'csv', 'argparse', 'subprocess', 'threading', 'tkinter',
+    'shlex', 'importlib', 'datetime', 'json', 'io', 'time', 'pathlib',
+    'collections', 'functools', 'typing', 'codecs', 'mmap', 'concurrent',
+    'common',
+})
+
 class App:
     def __init__(self, root):
         self.root = root
@@ -78,33 +118,59 @@ class App:
         self.progress.grid(row=4, column=0, columnspan=3, pady=(6,0))
         self.progress_label = tk.Label(frm, text='0%')
         self.progress_label.grid(row=4, column=3, padx=(6,0))
+        # Python-side copies of the bar's value/maximum; reading them back from
+        # the widget is a Tcl round-trip
+        self._progress_value = 0
+        self._progress_max = 100
 
         self.text = scrolledtext.ScrolledText(root, height=20, width=100)
         self.text.pack(padx=8, pady=(0,8), fill='both', expand=True)
+        # newlines currently held by self.text, to trim it without asking Tk
+        self._line_count = 0
 
         self.proc_thread = None
+        # test.py is checked once here; run() only re-checks after a failure
+        self._script_ok = os.path.isfile(SCRIPT_PATH)
+
+        # Everything a run wants shown goes through this queue: a str is log
+        # text, a (cur, total) tuple is progress and a callable is a UI step
+        # run in order. _drain_queue applies it on the Tk thread every
+        # _DRAIN_MS, so output is batched and repaint rate stays bounded.
+        self._out_q = queue.Queue()
+        self.root.after(_DRAIN_MS, self._drain_queue)
 
     def browse_input(self):
+        from tkinter import filedialog
         p = filedialog.askopenfilename(filetypes=[('TSV files','*.txt;*.tsv'),('All files','*.*')])
         if p:
             self.input_var.set(p)
 
     def browse_output(self):
+        from tkinter import filedialog
         p = filedialog.asksaveasfilename(defaultextension='.txt', filetypes=[('Text files','*.txt'),('All files','*.*')])
         if p:
             self.output_var.set(p)
 
     def append(self, text):
+        # see() schedules the scroll/redraw for the next idle pass; no need to
+        # force update_idletasks here
         self.text.insert('end', text)
+        self._line_count += text.count('\n')
+        if self._line_count > _MAX_LOG_LINES:
+            # drop the oldest lines so memory and insert cost stay bounded
+            excess = self._line_count - _MAX_LOG_LINES
+            self.text.delete('1.0', f'{excess + 1}.0')
+            self._line_count = _MAX_LOG_LINES
         self.text.see('end')
-        # keep progress bar visible updates responsive
-        self.root.update_idletasks()
 
     def set_progress(self, value, maximum=None):
         """Set progress bar value and update percent label.
 
         If maximum is provided, update the progress maximum as well.
         """
+        if maximum is not None:
+            self._progress_max = maximum
+        self._progress_value = value
         try:
             if maximum is not None:
                 self.progress.config(maximum=maximum)
@@ -114,116 +180,250 @@ class App:
                 self.progress['value'] = value
             except Exception:
                 pass
-        # compute percentage
+        # compute percentage from the cached maximum
         try:
-            maxv = float(self.progress['maximum'])
+            maxv = self._progress_max
             pct = int((float(value) / maxv) * 100) if maxv else 0
         except Exception:
             pct = 0
         self.progress_label.config(text=f"{pct}%")
-        self.root.update_idletasks()
+
+    def _bump_progress(self):
+        self.set_progress(min(self._progress_value + 1, self._progress_max))
+
+    def _apply_output(self, texts, progress):
+        if texts:
+            self.append(''.join(texts))
+        if progress is not None:
+            # Stop any indeterminate animation first, then switch to determinate and update
+            try:
+                self.progress.stop()
+            except Exception:
+                pass
+            # switch to determinate and set value via helper
+            self.set_progress(progress[0], maximum=progress[1])
+
+    def _drain_queue(self):
+        texts = []
+        progress = None
+        try:
+            for _ in range(_DRAIN_MAX_ITEMS):
+                try:
+                    item = self._out_q.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, str):
+                    texts.append(item)
+                elif isinstance(item, tuple):
+                    # only the latest progress matters
+                    progress = item
+                else:
+                    # a UI step: apply everything queued before it first
+                    self._apply_output(texts, progress)
+                    texts, progress = [], None
+                    item()
+            self._apply_output(texts, progress)
+        finally:
+            self.root.after(_DRAIN_MS, self._drain_queue)
 
     def run(self):
+        from tkinter import messagebox
         infile = self.input_var.get().strip()
         if not infile:
             messagebox.showwarning('Input required', 'Please select an input TSV file')
             return
-        if not os.path.isfile(SCRIPT_PATH):
+        if not self._script_ok:
+            self._script_ok = os.path.isfile(SCRIPT_PATH)
+        if not self._script_ok:
             messagebox.showerror('Script missing', f"Can't find test.py at {SCRIPT_PATH}")
             return
         args = [sys.executable, SCRIPT_PATH, infile]
         out = self.output_var.get().strip()
         if out:
             args += ['-o', out]
-        if self.install_var.get():
-            # detect imports in test.py and attempt to install missing packages
-            mods = detect_imports(SCRIPT_PATH)
-            # skip standard library common modules that shouldn't be installed
-            blacklist = {'sys','os','re','csv','argparse','subprocess','threading','tkinter','shlex','importlib','datetime'}
-            to_check = [m for m in mods if m not in blacklist]
-            if to_check:
-                # configure progress bar for package installs
-                self.progress.config(mode='determinate', maximum=len(to_check), value=0)
-                def append_and_update(s):
-                    self.append(s)
-                    # If message indicates a package installed or in-progress, update progress
-                    if 'Installing ' in s or 'installed.' in s:
-                        try:
-                            m = re.search(r"\((\d+)/(\d+)\)", s)
-                            if m:
-                                cur = int(m.group(1))
-                                total = int(m.group(2))
-                                self.set_progress(cur, maximum=total)
-                            else:
-                                # increment by 1
-                                cur = min(int(self.progress['value']) + 1, int(self.progress['maximum']))
-                                self.set_progress(cur)
-                        except Exception:
-                            try:
-                                cur = min(int(self.progress['value']) + 1, int(self.progress['maximum']))
-                                self.set_progress(cur)
-                            except Exception:
-                                pass
-
-                ok = Common.ensure_packages(to_check, append_output_func=append_and_update)
-                if not ok:
-                    messagebox.showerror('Install failed', 'Failed to install required packages. See output for details.')
-                    self.run_btn.config(state='normal')
-                    return
-                # reset progress bar and label
-                self.set_progress(0, maximum=len(to_check))
+        install = self.install_var.get()
+        if install:
             # also pass flag to the script in case it wants to handle installs itself
             args.append('--install-missing')
 
         # disable run button
         self.run_btn.config(state='disabled')
         self.text.delete('1.0', 'end')
-        self.append('Running: ' + ' '.join(shlex.quote(a) for a in args) + '\n\n')
+        self._line_count = 0
 
-        def target():
+        out_q = self._out_q
+
+        def enable_run():
+            self.run_btn.config(state='normal')
+
+        def install_missing():
+            """Detect and install packages test.py needs; runs on the worker thread.
+
+            Pip can take many seconds, so all widget updates go through the
+            output queue to the Tk thread. Returns False if the install failed.
+            """
+            # detect imports in test.py and attempt to install missing packages
+            mods = detect_imports(SCRIPT_PATH)
+            # skip standard library common modules that shouldn't be installed
+            to_check = [m for m in mods if m not in _BLACKLIST]
+            if not to_check:
+                return True
+            # configure progress bar for package installs
+            out_q.put((0, len(to_check)))
+
+            def append_and_update(s):
+                out_q.put(s)
+                # If message indicates a package installed or in-progress, update progress
+                if 'Installing ' in s or 'installed.' in s:
+                    m = _INSTALL_RE.search(s)
+                    if m:
+                        out_q.put((int(m.group(1)), int(m.group(2))))
+                    else:
+                        # increment by 1
+                        out_q.put(self._bump_progress)
+
+            ok = Common.ensure_packages(to_check, append_output_func=append_and_update)
+            if not ok:
+                def report_failure():
+                    messagebox.showerror('Install failed', 'Failed to install required packages. See output for details.')
+                    enable_run()
+                out_q.put(report_failure)
+                return False
+            # reset progress bar and label
+            out_q.put((0, len(to_check)))
+            return True
+
+        # Output is read in raw chunks of whatever the pipe holds (up to 64 KiB)
+        # and split into lines in memory rather than via readline per line.
+        # Progress is parsed from the raw bytes; only output that is actually
+        # shown gets decoded.
+        search = _PROGRESS_RE_B.search
+        tail = b''
+
+        def feed(chunk):
+            """Process one raw read from the child; b'' marks end of output."""
+            nonlocal tail
+            data = tail + chunk
+            tail = b''
+            if chunk:
+                # hold back a trailing partial line until the rest arrives
+                cut = data.rfind(b'\n') + 1
+                data, tail = data[:cut], data[cut:]
+            if not data:
+                return
+            if b'PROGRESS' in data:
+                # only the latest progress in the chunk matters
+                last = None
+                for last in _PROGRESS_RE_B.finditer(data):
+                    pass
+                if last:
+                    out_q.put((int(last.group(1)), int(last.group(2))))
+                data = b''.join(l for l in data.splitlines(keepends=True) if not search(l))
+                if not data:
+                    return
+            # data ends on a newline, so no UTF-8 sequence is split across chunks
+            out_q.put(data.decode('utf-8', 'replace').replace('\r\n', '\n').replace('\r', '\n'))
+
+        def start_indeterminate():
+            self.progress.config(mode='indeterminate')
+            self.progress.start(10)
+
+        def reset_progress():
+            # stop indeterminate progress
+            self.progress.stop()
+            self.progress.config(mode='determinate', value=0)
+            self._progress_value = 0
+
+        def start_process():
+            """Spawn test.py; returns the Popen, or None after reporting a failure."""
+            out_q.put('Running: ' + shlex.join(args) + '\n\n')
             try:
-                proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1, universal_newlines=True)
+                # The pipe stays in bytes mode and is read via os.read; output is
+                # decoded as UTF-8, so have the child write UTF-8 too (a piped
+                # stdout on Windows would otherwise use the ANSI code page).
+                env = dict(os.environ, PYTHONIOENCODING='utf-8')
+                proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
             except Exception as e:
-                self.root.after(0, lambda: (self.append(f'Failed to start process: {e}\n'), self.run_btn.config(state='normal')))
-                return
+                out_q.put(f'Failed to start process: {e}\n')
+                out_q.put(enable_run)
+                return None
 
             # show indeterminate progress while script runs
-            self.root.after(0, lambda: self.progress.config(mode='indeterminate'))
-            self.root.after(0, lambda: self.progress.start(10))
-
-            prog_re = re.compile(r"PROGRESS\s+(\d+)/(\d+)")
-            for line in proc.stdout:
-                m = prog_re.search(line)
-                if m:
-                    try:
-                        cur = int(m.group(1))
-                        total = int(m.group(2))
-                        # Stop any indeterminate animation first, then switch to determinate and update
-                        def update_progress(c=cur, t=total):
-                            try:
-                                self.progress.stop()
-                            except Exception:
-                                pass
-                            # switch to determinate and set value via helper
-                            self.set_progress(c, maximum=t)
-                        self.root.after(0, update_progress)
-                    except Exception:
-                        # fallback: just append if parsing fails
-                        self.root.after(0, lambda l=line: self.append(l))
+            out_q.put(start_indeterminate)
+            return proc
+
+        def finish(code):
+            # queued after the last output, so the final progress is applied
+            # before the bar is reset
+            out_q.put(reset_progress)
+            out_q.put(f"\nProcess exited with code {code}\n")
+            out_q.put(enable_run)
+
+        def read_blocking(proc):
+            # worker-thread path: block in os.read until the child closes stdout
+            fd = proc.stdout.fileno()
+            while True:
+                chunk = os.read(fd, 65536)
+                feed(chunk)
+                if not chunk:
+                    break
+            proc.stdout.close()
+            finish(proc.wait())
+
+        def watch(proc):
+            # Tk-thread path: the event loop selects on the pipe and calls back
+            # when data is ready, so no reader thread is needed. One read per
+            # callback keeps the UI responsive while the child is chatty.
+            fd = proc.stdout.fileno()
+            os.set_blocking(fd, False)
+
+            def on_readable(_fd, _mask):
+                try:
+                    chunk = os.read(fd, 65536)
+                except BlockingIOError:
+                    return
+                feed(chunk)
+                if not chunk:
+                    self.root.tk.deletefilehandler(fd)
+                    proc.stdout.close()
+                    wait_exit()
+
+            def wait_exit():
+                # stdout is closed, so the child is about to exit; poll rather
+                # than block the event loop in wait()
+                code = proc.poll()
+                if code is None:
+                    self.root.after(50, wait_exit)
                 else:
-                    self.root.after(0, lambda l=line: self.append(l))
-            proc.wait()
-            code = proc.returncode
+                    finish(code)
 
-            # stop indeterminate progress
-            self.root.after(0, lambda: self.progress.stop())
-            self.root.after(0, lambda: self.progress.config(mode='determinate', value=0))
+            self.root.tk.createfilehandler(fd, tk.READABLE, on_readable)
+
+        def run_watched():
+            proc = start_process()
+            if proc is not None:
+                watch(proc)
 
-            self.root.after(0, lambda: self.append(f"\nProcess exited with code {code}\n"))
-            self.root.after(0, lambda: self.run_btn.config(state='normal'))
+        # Tk can only watch pipes with createfilehandler on Unix; Windows keeps
+        # a reader thread.
+        use_filehandler = os.name != 'nt'
+
+        def target():
+            if install and not install_missing():
+                return
+            if use_filehandler:
+                out_q.put(run_watched)
+            else:
+                proc = start_process()
+                if proc is not None:
+                    read_blocking(proc)
 
-        self.proc_thread = threading.Thread(target=target, daemon=True)
-        self.proc_thread.start()
+        if install or not use_filehandler:
+            # pip installs (and Windows pipe reads) block, so keep them off the Tk thread
+            self.proc_thread = threading.Thread(target=target, daemon=True)
+            self.proc_thread.start()
+        else:
+            run_watched()
 
 
 if __name__ == '__main__':